@@ -1,24 +1,42 @@
 import os
-import math
-import random
-from datetime import datetime, timedelta
+import asyncio
+import csv
+import io
+import logging
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict, Any
 
-from fastapi import FastAPI, Query, Response
+import numpy as np
+import orjson
+from fastapi import FastAPI, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse
 
 try:
     # Database utilities (MongoDB)
-    from database import db, create_document, get_documents
+    from database import db
 except Exception:
     db = None
-    def create_document(*args, **kwargs):
-        raise Exception("Database not available")
-    def get_documents(*args, **kwargs):
-        raise Exception("Database not available")
 
-app = FastAPI(title="TOFY-X1 Backend", version="1.2.0")
+logger = logging.getLogger(__name__)
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+
+def _dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=_ORJSON_OPTIONS)
+
+
+class UTCORJSONResponse(ORJSONResponse):
+    """orjson response that emits naive datetimes as UTC with a trailing "Z"."""
+
+    def render(self, content: Any) -> bytes:
+        return _dumps(content)
+
+
+app = FastAPI(title="TOFY-X1 Backend", version="1.2.0", default_response_class=UTCORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,58 +46,124 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+class _GZipExceptStream(GZipMiddleware):
+    """Gzip responses, except the SSE stream, whose events must not sit in the compressor buffer."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/api/telemetry/stream":
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+app.add_middleware(_GZipExceptStream, minimum_size=1024)
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "TOFY-X1 backend running", "time": datetime.utcnow().isoformat()}
 
+# Shared, never mutated: attached to every telemetry payload as-is
+_IMAGE_URL_DICT = {
+    "url": "https://images.unsplash.com/photo-1462331940025-496dfbfc7564?q=80&w=1600&auto=format&fit=crop"
+}
+
+# Fixed response bodies, serialized once at import
+_HELLO_BYTES = orjson.dumps({"message": "Hello from the TOFY-X1 backend API!"})
+_IMAGE_BYTES = orjson.dumps(_IMAGE_URL_DICT)
+
+# HTTP caching: the image URL never changes; telemetry is only meaningful for about a second
+_IMAGE_ETAG = '"img-v1"'
+_IMAGE_CACHE_HEADERS = {"Cache-Control": "public, max-age=86400, immutable", "ETag": _IMAGE_ETAG}
+_TELEMETRY_CACHE_HEADERS = {"Cache-Control": "public, max-age=1, stale-while-revalidate=5"}
+
 @app.get("/api/hello")
-def hello():
-    return {"message": "Hello from the TOFY-X1 backend API!"}
+async def hello():
+    return Response(_HELLO_BYTES, media_type="application/json")
 
 # --- Simulation helpers ---
-_start = datetime.utcnow().timestamp()
-
-def _sim_value(base: float, amp: float, speed: float, noise: float = 0.5) -> float:
-    t = datetime.utcnow().timestamp() - _start
-    return base + amp * math.sin(t * speed) + random.uniform(-noise, noise)
+_start = time.monotonic()
+
+# One lane per simulated signal: (base, amplitude, speed, noise)
+_SIM_PARAMS = np.array([
+    (22.0, 6.0, 0.06, 0.5),          # ambient temp (C)
+    (5.0, 3.0, 0.08, 0.3),           # surface delta over ambient
+    (4.0, 3.0, 0.05, 0.4),           # uv index
+    (250.0, 120.0, 0.03, 5.0),       # ir radiation (mW/m^2 approx)
+    (20000.0, 15000.0, 0.04, 500.0), # light lux
+    (78.0, 8.0, 0.01, 1.0),          # battery pct
+    (2.0, 10.0, 0.02, 0.8),          # pitch
+    (1.0, 12.0, 0.018, 0.8),         # roll
+    (0.0, 0.0008, 0.002, 0.0001),    # lat offset
+    (0.0, 0.0008, 0.002, 0.0001),    # lon offset
+    (0.8, 0.6, 0.07, 0.2),           # speed
+    (0.0, 5.0, 0.2, 1.5),            # panel azimuth offset
+])
+_BASE, _AMP, _SPEED, _NOISE = _SIM_PARAMS.T.copy()
+_rng = np.random.default_rng()
+
+# Sine lookup table with linear interpolation; the extra last entry equals the first for wraparound
+_SIN_LUT_SIZE = 4096
+_SIN_LUT = np.sin(np.linspace(0.0, 2 * np.pi, _SIN_LUT_SIZE + 1))
+_SIN_LUT_SCALE = _SIN_LUT_SIZE / (2 * np.pi)
+
+
+def _fast_sin(x: np.ndarray) -> np.ndarray:
+    """Approximate sin for non-negative angles; plenty accurate for simulated telemetry."""
+    pos = x * _SIN_LUT_SCALE
+    whole = np.floor(pos)
+    frac = pos - whole
+    i = whole.astype(np.int64) & (_SIN_LUT_SIZE - 1)
+    lo = _SIN_LUT[i]
+    return lo + frac * (_SIN_LUT[i + 1] - lo)
+
+
+_DANGER_LEVELS = ("low", "medium", "high")
 
 
 def _make_telemetry_payload() -> Dict[str, Any]:
+    elapsed = time.monotonic() - _start
+    ts = time.time()
+    now = datetime.fromtimestamp(ts, timezone.utc)
+    vals = _BASE + _AMP * _fast_sin(elapsed * _SPEED) + _rng.uniform(-_NOISE, _NOISE)
+    (
+        ambient_v, surface_delta, uv_v, ir_v, lux_v, battery_v,
+        pitch_v, roll_v, lat_off, lon_off, speed_v, panel_off,
+    ) = vals.tolist()
+
     # Environmental
-    ambient_temp = round(_sim_value(22.0, 6.0, 0.06), 2)  # C
-    surface_temp = round(ambient_temp + _sim_value(5.0, 3.0, 0.08, 0.3), 2)
-    uv_index = max(0.0, round(_sim_value(4.0, 3.0, 0.05, 0.4), 2))
-    ir_radiation = max(0.0, round(_sim_value(250.0, 120.0, 0.03, 5.0), 2))  # mW/m^2 approx
-    light_lux = max(0.0, round(_sim_value(20000.0, 15000.0, 0.04, 500.0), 2))
+    ambient_temp = ambient_v  # C
+    surface_temp = ambient_temp + surface_delta
+    uv_index = max(0.0, uv_v)
+    ir_radiation = max(0.0, ir_v)  # mW/m^2 approx
+    light_lux = max(0.0, lux_v)
 
     # Power
-    battery_pct = min(100.0, max(0.0, round(_sim_value(78.0, 8.0, 0.01, 1.0), 1)))
-    battery_voltage = round(3.0 + battery_pct / 100.0 * 1.2, 2)
+    battery_pct = min(100.0, max(0.0, battery_v))
+    battery_voltage = 3.0 + battery_pct / 100.0 * 1.2
 
     # Orientation (MPU6050)
-    pitch = round(_sim_value(2.0, 10.0, 0.02, 0.8), 2)
-    roll = round(_sim_value(1.0, 12.0, 0.018, 0.8), 2)
-    yaw = (datetime.utcnow().timestamp() * 12) % 360
+    pitch = pitch_v
+    roll = roll_v
+    yaw = (ts * 12) % 360
 
     # GPS approx
-    lat = 46.0569 + _sim_value(0.0, 0.0008, 0.002, 0.0001)
-    lon = 14.5058 + _sim_value(0.0, 0.0008, 0.002, 0.0001)
+    lat = 46.0569 + lat_off
+    lon = 14.5058 + lon_off
 
     # Solar panel orientation target (like sunflower)
-    sun_dir = (datetime.utcnow().timestamp() * 6) % 360
+    sun_dir = (ts * 6) % 360
 
     # Camouflage color based on environment (blue=cool, red=hot)
     hue = max(0, min(220, int(220 - (surface_temp - 10) * (220 / 50))))
     camo_color_hsl = f"hsl({hue}, 70%, 55%)"
 
-    danger = "low"
-    if uv_index > 7 or surface_temp > 50:
-        danger = "high"
-    elif uv_index > 5 or surface_temp > 40:
-        danger = "medium"
+    # Each tier implies the one below, so the level is the count of tiers reached
+    level = ((uv_index > 5) | (surface_temp > 40)) + ((uv_index > 7) | (surface_temp > 50))
+    danger = _DANGER_LEVELS[level]
 
     return {
-        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "timestamp": now,
         "environment": {
             "ambient_temp_c": ambient_temp,
             "surface_temp_c": surface_temp,
@@ -94,17 +178,17 @@ def _make_telemetry_payload() -> Dict[str, Any]:
         "attitude": {
             "pitch": pitch,
             "roll": roll,
-            "yaw": round(yaw, 2),
+            "yaw": yaw,
         },
         "navigation": {
-            "lat": round(lat, 6),
-            "lon": round(lon, 6),
-            "speed_mps": round(max(0.0, _sim_value(0.8, 0.6, 0.07, 0.2)), 2),
-            "heading": round(yaw, 2),
+            "lat": lat,
+            "lon": lon,
+            "speed_mps": max(0.0, speed_v),
+            "heading": yaw,
         },
         "solar": {
-            "target_azimuth": round(sun_dir, 2),
-            "panel_azimuth": round(sun_dir + _sim_value(0.0, 5.0, 0.2, 1.5), 2),
+            "target_azimuth": sun_dir,
+            "panel_azimuth": sun_dir + panel_off,
             "light_lux": light_lux,
         },
         "camouflage": {
@@ -114,68 +198,280 @@ def _make_telemetry_payload() -> Dict[str, Any]:
     }
 
 
-def _active_session() -> Optional[dict]:
-    if not db:
+# Active-session lookup memo; start/stop invalidate it by zeroing "ts"
+_SESSION_TTL = 2.0
+_sess_cache: Dict[str, Any] = {"val": None, "ts": 0.0}
+
+
+async def _active_session() -> Optional[dict]:
+    if db is None:
         return None
+    now = time.monotonic()
+    if now - _sess_cache["ts"] < _SESSION_TTL:
+        return _sess_cache["val"]
     try:
-        return db["session"].find_one({"active": True})
+        sess = await db["session"].find_one({"active": True})
     except Exception:
         return None
+    _sess_cache.update(val=sess, ts=now)
+    return sess
+
+
+# --- Batched telemetry persistence ---
+# Snapshots are queued by the request handler and written in bulk by a background task
+_FLUSH_INTERVAL = 0.25
+_FLUSH_BATCH_SIZE = 500
+_QUEUE_MAX = 10000
+# Created per lifespan in the startup hook; a Queue is bound to the event loop that first uses it
+_telemetry_queue: "Optional[asyncio.Queue[Dict[str, Any]]]" = None
+_flush_task: Optional[asyncio.Task] = None
+
+
+def _enqueue_telemetry(payload: Dict[str, Any]) -> None:
+    """Queue a snapshot for persistence, dropping the oldest one if the queue is full."""
+    if _telemetry_queue is None:
+        return
+    # Reuse the snapshot's own clock read rather than taking another one
+    now = payload["timestamp"]
+    # insert_many adds an _id to each document, so never hand it the payload we return
+    # Persist timestamp as the ISO string the schema declares; created_at carries the Date
+    doc = dict(payload, timestamp=now.replace(tzinfo=None).isoformat() + "Z", created_at=now, updated_at=now)
+    if _telemetry_queue.full():
+        try:
+            _telemetry_queue.get_nowait()
+            logger.warning("Telemetry queue full (%d); dropped the oldest snapshot", _QUEUE_MAX)
+        except asyncio.QueueEmpty:
+            pass
+    _telemetry_queue.put_nowait(doc)
 
 
-@app.get("/api/telemetry")
-def telemetry():
-    """Return simulated real-time telemetry for the rover and optionally persist when a session is active."""
+async def _insert_batch(batch: List[Dict[str, Any]]) -> None:
+    if not batch or db is None:
+        return
+    # Unordered so a single bad document doesn't abort the rest of the batch
+    insert = asyncio.ensure_future(db["telemetry"].insert_many(batch, ordered=False))
+    try:
+        await asyncio.shield(insert)
+    except asyncio.CancelledError:
+        # Shutdown cancelled us mid-write; let the write finish rather than lose the batch
+        await asyncio.wait([insert])
+        if not insert.cancelled() and insert.exception() is not None:
+            logger.error("Failed to write telemetry batch", exc_info=insert.exception())
+        raise
+    except Exception:
+        logger.exception("Failed to write telemetry batch")
+
+
+async def _flush_loop() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        batch: List[Dict[str, Any]] = []
+        deadline = loop.time() + _FLUSH_INTERVAL
+        try:
+            while len(batch) < _FLUSH_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(_telemetry_queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            # Snapshots already taken off the queue would otherwise be lost on shutdown
+            await _insert_batch(batch)
+            raise
+        await _insert_batch(batch)
+
+
+@app.on_event("startup")
+async def _start_flusher():
+    global _telemetry_queue, _flush_task
+    if db is None:
+        return
+    _telemetry_queue = asyncio.Queue(maxsize=_QUEUE_MAX)
+    _flush_task = asyncio.create_task(_flush_loop())
+
+
+# Optional retention for recorded telemetry, e.g. TELEMETRY_TTL_DAYS=7
+_TELEMETRY_TTL_DAYS = os.getenv("TELEMETRY_TTL_DAYS")
+
+
+# Index builds run in the background so an unreachable database doesn't hold up startup
+_index_task: Optional[asyncio.Task] = None
+
+
+async def _ensure_indexes() -> None:
+    try:
+        await db["session"].create_index([("active", 1)])
+        if not _TELEMETRY_TTL_DAYS:
+            await db["telemetry"].create_index([("created_at", -1)], background=True)
+            return
+        # TTL lives on the single created_at index; direction doesn't matter for expiry
+        ttl = int(_TELEMETRY_TTL_DAYS) * 86400
+        try:
+            await db["telemetry"].create_index([("created_at", -1)], background=True, expireAfterSeconds=ttl)
+        except Exception as e:
+            if getattr(e, "code", None) != 85:  # IndexOptionsConflict: index exists with other options
+                raise
+            await db.command(
+                "collMod", "telemetry", index={"keyPattern": {"created_at": -1}, "expireAfterSeconds": ttl}
+            )
+    except Exception:
+        logger.exception("Failed to ensure telemetry indexes")
+
+
+@app.on_event("startup")
+async def _start_index_build():
+    global _index_task
+    if db is not None:
+        _index_task = asyncio.create_task(_ensure_indexes())
+
+
+async def _cancel_task(task: Optional[asyncio.Task]) -> None:
+    if task is None or task.done():
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+@app.on_event("shutdown")
+async def _stop_background_tasks():
+    """Cancel the index build and diagnostics probe, which may still be waiting on an unreachable database."""
+    global _index_task, _diag_task
+    await _cancel_task(_index_task)
+    await _cancel_task(_diag_task)
+    _index_task = _diag_task = None
+
+
+@app.on_event("shutdown")
+async def _stop_flusher():
+    """Stop the flusher and write whatever is still queued."""
+    global _telemetry_queue, _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    if _telemetry_queue is None:
+        return
+    batch: List[Dict[str, Any]] = []
+    while True:
+        try:
+            batch.append(_telemetry_queue.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    _telemetry_queue = None
+    await _insert_batch(batch)
+
+
+# Short-lived memo of the last payload; concurrent pollers within the TTL share one computation
+_PAYLOAD_TTL = 0.05
+_last_ts = 0.0
+_last_payload: Optional[Dict[str, Any]] = None
+
+
+async def _current_payload() -> Dict[str, Any]:
+    """Return the memoized payload, computing (and persisting, if recording) a fresh one when stale."""
+    global _last_ts, _last_payload
+    now = time.monotonic()
+    if _last_payload is not None and now - _last_ts < _PAYLOAD_TTL:
+        return _last_payload
+
     payload = _make_telemetry_payload()
 
     # Auto-attach image url for convenience
-    payload["image"] = {
-        "url": "https://images.unsplash.com/photo-1462331940025-496dfbfc7564?q=80&w=1600&auto=format&fit=crop"
-    }
+    payload["image"] = _IMAGE_URL_DICT
+    _last_ts, _last_payload = now, payload
 
     # If a recording session is active, persist this snapshot
-    sess = _active_session()
+    sess = await _active_session()
     if sess:
-        try:
-            create_document("telemetry", payload)
-        except Exception:
-            pass
+        _enqueue_telemetry(payload)
 
     return payload
 
 
+@app.get("/api/telemetry")
+async def telemetry():
+    """Return simulated real-time telemetry for the rover and optionally persist when a session is active."""
+    payload = await _current_payload()
+    return UTCORJSONResponse(payload, headers=_TELEMETRY_CACHE_HEADERS)
+
+
+_STREAM_INTERVAL = 0.1
+
+
+@app.get("/api/telemetry/stream")
+async def telemetry_stream():
+    """Push telemetry as Server-Sent Events every 100 ms over a single connection."""
+    async def generate():
+        while True:
+            payload = await _current_payload()
+            yield b"data: " + _dumps(payload) + b"\n\n"
+            await asyncio.sleep(_STREAM_INTERVAL)
+
+    return StreamingResponse(generate(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
 @app.post("/api/session/start")
-def start_session():
+async def start_session():
     """Start a recording session so that subsequent telemetry calls are stored."""
-    if not db:
+    if db is None:
         return JSONResponse({"status": "error", "message": "Database not configured"}, status_code=400)
 
     # Deactivate previous sessions
-    db["session"].update_many({"active": True}, {"$set": {"active": False, "ended_at": datetime.utcnow()}})
+    await db["session"].update_many({"active": True}, {"$set": {"active": False, "ended_at": datetime.utcnow()}})
     sess = {
         "active": True,
         "started_at": datetime.utcnow(),
         "note": "TOFY-X1 recording session"
     }
-    db["session"].insert_one(sess)
+    await db["session"].insert_one(sess)
+    _sess_cache["ts"] = 0.0
     return {"status": "ok", "active": True}
 
 
 @app.post("/api/session/stop")
-def stop_session():
-    if not db:
+async def stop_session():
+    if db is None:
         return JSONResponse({"status": "error", "message": "Database not configured"}, status_code=400)
-    db["session"].update_many({"active": True}, {"$set": {"active": False, "ended_at": datetime.utcnow()}})
+    await db["session"].update_many({"active": True}, {"$set": {"active": False, "ended_at": datetime.utcnow()}})
+    _sess_cache["ts"] = 0.0
     return {"status": "ok", "active": False}
 
 
+# Field projections so Mongo only ships what each endpoint uses
+_HISTORY_PROJECTION = {"image": 0}
+_CSV_PROJECTION = {
+    "_id": 0,
+    "timestamp": 1,
+    "environment": 1,
+    "power": 1,
+    "attitude": 1,
+    "navigation": 1,
+    "solar.target_azimuth": 1,
+    "solar.panel_azimuth": 1,
+    "camouflage": 1,
+    "danger_level": 1,
+    "created_at": 1,
+}
+
+
 @app.get("/api/telemetry/history")
-def telemetry_history(
+async def telemetry_history(
     limit: int = Query(300, ge=1, le=5000),
     minutes: Optional[int] = Query(None, ge=1, le=1440),
 ):
     """Return recent telemetry documents, optionally limited to last N minutes."""
-    if not db:
+    if db is None:
         return JSONResponse({"status": "error", "message": "Database not configured"}, status_code=400)
 
     q: Dict[str, Any] = {}
@@ -183,23 +479,23 @@ def telemetry_history(
         since = datetime.utcnow() - timedelta(minutes=minutes)
         q = {"created_at": {"$gte": since}}
 
-    docs = list(db["telemetry"].find(q).sort("created_at", -1).limit(limit))
+    docs = await db["telemetry"].find(q, _HISTORY_PROJECTION, sort=[("created_at", -1)], limit=limit).to_list(length=limit)
     for d in docs:
         d["_id"] = str(d["_id"])  # make JSON serializable
         if "created_at" in d:
             d["created_at"] = d["created_at"].isoformat()
         if "updated_at" in d:
             d["updated_at"] = d["updated_at"].isoformat()
-    return {"items": list(reversed(docs))}
+    return UTCORJSONResponse({"items": list(reversed(docs))})
 
 
 @app.get("/api/export/csv")
-def export_csv(
+async def export_csv(
     minutes: Optional[int] = Query(None, ge=1, le=1440),
     limit: int = Query(2000, ge=10, le=20000),
 ):
     """Export telemetry history as CSV."""
-    if not db:
+    if db is None:
         return JSONResponse({"status": "error", "message": "Database not configured"}, status_code=400)
 
     q: Dict[str, Any] = {}
@@ -207,7 +503,16 @@ def export_csv(
         since = datetime.utcnow() - timedelta(minutes=minutes)
         q = {"created_at": {"$gte": since}}
 
-    docs = list(db["telemetry"].find(q).sort("created_at", -1).limit(limit))
+    # Find the oldest of the newest `limit` docs so rows can be streamed oldest-first without buffering.
+    # Trade-off: created_at has millisecond precision, so if other snapshots share the edge doc's
+    # millisecond, $gte admits them too and the ascending limit below drops that many of the newest
+    # rows. Adding an _id tiebreaker would defeat the single-field created_at index and force an
+    # in-memory sort before the first row, so the (rare, few-row) boundary skew is accepted.
+    edge = await db["telemetry"].find(
+        q, {"_id": 0, "created_at": 1}, sort=[("created_at", -1)], skip=limit - 1, limit=1
+    ).to_list(length=1)
+    if edge:
+        q = {"created_at": {"$gte": edge[0]["created_at"]}}
 
     # CSV header
     headers = [
@@ -222,83 +527,122 @@ def export_csv(
         "created_at"
     ]
 
-    def row(d: Dict[str, Any]) -> List[str]:
+    def row(d: Dict[str, Any]) -> List[Any]:
         env = d.get("environment", {})
         powr = d.get("power", {})
         att = d.get("attitude", {})
         nav = d.get("navigation", {})
         sol = d.get("solar", {})
         cam = d.get("camouflage", {})
+        created = d.get("created_at", "")
         return [
             d.get("timestamp", ""),
-            str(env.get("ambient_temp_c", "")), str(env.get("surface_temp_c", "")), str(env.get("uv_index", "")), str(env.get("ir_mw_m2", "")), str(env.get("light_lux", "")),
-            str(powr.get("battery_pct", "")), str(powr.get("battery_voltage", "")),
-            str(att.get("pitch", "")), str(att.get("roll", "")), str(att.get("yaw", "")),
-            str(nav.get("lat", "")), str(nav.get("lon", "")), str(nav.get("speed_mps", "")), str(nav.get("heading", "")),
-            str(sol.get("target_azimuth", "")), str(sol.get("panel_azimuth", "")),
+            env.get("ambient_temp_c", ""), env.get("surface_temp_c", ""), env.get("uv_index", ""), env.get("ir_mw_m2", ""), env.get("light_lux", ""),
+            powr.get("battery_pct", ""), powr.get("battery_voltage", ""),
+            att.get("pitch", ""), att.get("roll", ""), att.get("yaw", ""),
+            nav.get("lat", ""), nav.get("lon", ""), nav.get("speed_mps", ""), nav.get("heading", ""),
+            sol.get("target_azimuth", ""), sol.get("panel_azimuth", ""),
             cam.get("color_hsl", ""),
             d.get("danger_level", ""),
-            d.get("created_at").isoformat() if isinstance(d.get("created_at"), datetime) else str(d.get("created_at", "")),
+            created.isoformat() if isinstance(created, datetime) else created,
         ]
 
-    def generate():
-        yield ",".join(headers) + "\n"
-        for d in reversed(docs):
-            yield ",".join(row(d)) + "\n"
+    # csv.writer handles str conversion and quotes fields such as "hsl(h, 70%, 55%)"
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+
+    def take() -> str:
+        line = buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+        return line
+
+    async def generate():
+        writer.writerow(headers)
+        yield take()
+        async for d in db["telemetry"].find(q, _CSV_PROJECTION, sort=[("created_at", 1)]).limit(limit):
+            writer.writerow(row(d))
+            yield take()
 
     return StreamingResponse(generate(), media_type="text/csv", headers={
         "Content-Disposition": "attachment; filename=tofy_telemetry.csv"
     })
 
 
+# Metric name -> dotted document path, aggregated by /api/metrics/summary
+_SUMMARY_FIELDS = {
+    "ambient_temp_c": "environment.ambient_temp_c",
+    "surface_temp_c": "environment.surface_temp_c",
+    "uv_index": "environment.uv_index",
+    "light_lux": "environment.light_lux",
+    "battery_pct": "power.battery_pct",
+    "speed_mps": "navigation.speed_mps",
+}
+
+
 @app.get("/api/metrics/summary")
-def metrics_summary(minutes: int = Query(60, ge=1, le=1440)):
+async def metrics_summary(minutes: int = Query(60, ge=1, le=1440)):
     """Compute min/max/avg for key metrics in a time window."""
-    if not db:
+    if db is None:
         return JSONResponse({"status": "error", "message": "Database not configured"}, status_code=400)
     since = datetime.utcnow() - timedelta(minutes=minutes)
     q = {"created_at": {"$gte": since}}
-    docs = list(db["telemetry"].find(q))
-    if not docs:
+    group: Dict[str, Any] = {"_id": None, "count": {"$sum": 1}}
+    for name, path in _SUMMARY_FIELDS.items():
+        field = "$" + path
+        group[f"{name}_min"] = {"$min": field}
+        group[f"{name}_max"] = {"$max": field}
+        group[f"{name}_avg"] = {"$avg": field}
+
+    res = await db["telemetry"].aggregate([{"$match": q}, {"$group": group}]).to_list(length=1)
+    if not res:
         return {"items": 0, "summary": {}}
-
-    def agg(path: List[str]):
-        vals = []
-        for d in docs:
-            cur = d
-            for p in path:
-                cur = cur.get(p, {}) if isinstance(cur, dict) else {}
-            try:
-                vals.append(float(cur))
-            except Exception:
-                pass
-        if not vals:
-            return {"min": None, "max": None, "avg": None}
-        return {"min": min(vals), "max": max(vals), "avg": sum(vals) / len(vals)}
+    stats = res[0]
 
     return {
-        "items": len(docs),
+        "items": stats["count"],
         "summary": {
-            "ambient_temp_c": agg(["environment", "ambient_temp_c"]),
-            "surface_temp_c": agg(["environment", "surface_temp_c"]),
-            "uv_index": agg(["environment", "uv_index"]),
-            "light_lux": agg(["environment", "light_lux"]),
-            "battery_pct": agg(["power", "battery_pct"]),
-            "speed_mps": agg(["navigation", "speed_mps"]),
+            name: {
+                "min": stats.get(f"{name}_min"),
+                "max": stats.get(f"{name}_max"),
+                "avg": stats.get(f"{name}_avg"),
+            }
+            for name in _SUMMARY_FIELDS
         },
     }
 
 
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    """Weak If-None-Match comparison: accepts "*", comma-separated lists and W/ prefixes."""
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
 @app.get("/api/image")
-def image():
+async def image(request: Request):
     """Provide a sample camera frame (static placeholder)."""
-    return {
-        "url": "https://images.unsplash.com/photo-1462331940025-496dfbfc7564?q=80&w=1600&auto=format&fit=crop"
-    }
+    if _etag_matches(request.headers.get("if-none-match"), _IMAGE_ETAG):
+        return Response(status_code=304, headers=_IMAGE_CACHE_HEADERS)
+    return Response(_IMAGE_BYTES, media_type="application/json", headers=_IMAGE_CACHE_HEADERS)
 
 
-@app.get("/test")
-def test_database():
+# Diagnostics are probed at startup and refreshed at most every 30 s, not on every hit
+_DIAG_TTL = 30.0
+_DIAG: Dict[str, Any] = {"val": None, "ts": 0.0}
+_DATABASE_URL_STATUS = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
+_DATABASE_NAME_STATUS = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
+
+
+async def _probe_database() -> Dict[str, Any]:
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -311,11 +655,12 @@ def test_database():
     try:
         if db is not None:
             response["database"] = "✅ Available"
-            response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
+            response["database_url"] = _DATABASE_URL_STATUS
+            response["database_name"] = _DATABASE_NAME_STATUS
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                await db.command("ping")
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -328,7 +673,43 @@ def test_database():
     return response
 
 
+async def _refresh_diagnostics() -> Dict[str, Any]:
+    val = await _probe_database()
+    _DIAG.update(val=val, ts=time.monotonic())
+    return val
+
+
+_diag_task: Optional[asyncio.Task] = None
+
+
+def _start_diag_refresh() -> asyncio.Task:
+    """Start a diagnostics refresh unless one is already in flight, and return it."""
+    global _diag_task
+    if _diag_task is None or _diag_task.done():
+        _diag_task = asyncio.create_task(_refresh_diagnostics())
+    return _diag_task
+
+
+@app.on_event("startup")
+async def _startup_probe():
+    # Not awaited: an unreachable database must not delay startup
+    _start_diag_refresh()
+
+
+@app.get("/test")
+async def test_database():
+    if _DIAG["val"] is not None and time.monotonic() - _DIAG["ts"] < _DIAG_TTL:
+        return _DIAG["val"]
+    task = _start_diag_refresh()
+    if _DIAG["val"] is not None:
+        # Serve the stale result while the single in-flight refresh runs
+        return _DIAG["val"]
+    # Shielded so a disconnecting client doesn't cancel the probe other callers share
+    return await asyncio.shield(task)
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WORKERS", (os.cpu_count() or 1) * 2 + 1))
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers, loop="uvloop", http="httptools")